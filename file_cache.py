@@ -0,0 +1,165 @@
+import asyncio
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+
+from telegram.error import BadRequest
+
+logger = logging.getLogger(__name__)
+
+
+class FileIdCache:
+  """Persistent map of file content hash -> Telegram file_id.
+
+  A file_id is only valid for the bot that uploaded it, so entries are stored
+  per bot id: {bot_id: {sha256: {"file_id": ..., "path": ...}}}.
+
+  Worker processes share the file, so each one records its own changes and
+  merges them into the file on disk under an exclusive flock.
+  """
+
+  def __init__(self, path):
+    self.path = path
+    self._lock = threading.Lock()
+    self._save_lock = threading.Lock()
+    self._digests = {}  # file path -> (mtime_ns, size, sha256)
+    self._upload_locks = {}
+    self._changes = {}  # (bot_id, sha256) -> entry, or None when discarded
+    self._entries = self._load()
+
+  def _load(self):
+    try:
+      with open(self.path, encoding="utf-8") as f:
+        return json.load(f)
+    except FileNotFoundError:
+      return {}
+    except (OSError, ValueError):
+      logger.warning("Ignoring unreadable file_id cache at %s", self.path)
+      return {}
+
+  @staticmethod
+  def _apply(entries, changes):
+    for (bot_id, digest), entry in changes.items():
+      bot_entries = entries.setdefault(bot_id, {})
+      if entry is None:
+        bot_entries.pop(digest, None)
+        continue
+      # Drop ids uploaded for older contents of the same file.
+      path = entry["path"]
+      for stale in [d for d, e in bot_entries.items() if e["path"] == path]:
+        del bot_entries[stale]
+      bot_entries[digest] = entry
+
+  def _sync(self, write):
+    """Merge pending changes with the file on disk, and optionally save."""
+    with self._save_lock, open(f"{self.path}.lock", "a") as lock_file:
+      fcntl.flock(lock_file, fcntl.LOCK_EX)
+      entries = self._load()
+      with self._lock:
+        changes = dict(self._changes)
+      self._apply(entries, changes)
+
+      if write:
+        self._write(entries)
+
+      with self._lock:
+        if write:
+          for key, entry in changes.items():
+            if self._changes.get(key, entry) is entry:
+              self._changes.pop(key, None)
+        # Keep changes made while the file was being written.
+        self._apply(entries, self._changes)
+        self._entries = entries
+
+  def _write(self, entries):
+    with tempfile.NamedTemporaryFile(
+        "w",
+        encoding="utf-8",
+        dir=os.path.dirname(os.path.abspath(self.path)),
+        prefix=os.path.basename(self.path),
+        suffix=".tmp",
+        delete=False,
+    ) as f:
+      json.dump(entries, f)
+    try:
+      os.replace(f.name, self.path)
+    except OSError:
+      os.unlink(f.name)
+      raise
+
+  def _save(self):
+    self._sync(write=True)
+
+  def digest(self, file_path):
+    # Only re-hash when the file's mtime or size changed since the last send.
+    stat = os.stat(file_path)
+    cached = self._digests.get(file_path)
+    if cached and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+      return cached[2]
+
+    sha256 = hashlib.sha256()
+    with open(file_path, "rb") as f:
+      for chunk in iter(lambda: f.read(1 << 20), b""):
+        sha256.update(chunk)
+    digest = sha256.hexdigest()
+    self._digests[file_path] = (stat.st_mtime_ns, stat.st_size, digest)
+    return digest
+
+  def get(self, bot_id, digest):
+    with self._lock:
+      entry = self._entries.get(str(bot_id), {}).get(digest)
+    return entry["file_id"] if entry else None
+
+  def set(self, bot_id, digest, file_path, file_id):
+    change = {(str(bot_id), digest): {"file_id": file_id, "path": file_path}}
+    with self._lock:
+      self._changes.update(change)
+      self._apply(self._entries, change)
+
+  def discard(self, bot_id, digest):
+    change = {(str(bot_id), digest): None}
+    with self._lock:
+      self._changes.update(change)
+      self._apply(self._entries, change)
+
+  async def send_document(self, bot, chat_id, file_path, **kwargs):
+    """Send a local file, uploading it only if no cached file_id exists."""
+    digest = await asyncio.to_thread(self.digest, file_path)
+
+    file_id = self.get(bot.id, digest)
+    if file_id:
+      try:
+        return await bot.send_document(chat_id, document=file_id, **kwargs)
+      except BadRequest as exc:
+        logger.warning("Cached file_id for %s rejected: %s", file_path, exc)
+        self.discard(bot.id, digest)
+
+    # Concurrent first sends of the same file share a single upload.
+    lock = self._upload_locks.setdefault((bot.id, digest), asyncio.Lock())
+    async with lock:
+      file_id = self.get(bot.id, digest)
+      if not file_id:
+        # Another worker process may have uploaded it already.
+        await asyncio.to_thread(self._sync, False)
+        file_id = self.get(bot.id, digest)
+      if file_id:
+        return await bot.send_document(chat_id, document=file_id, **kwargs)
+
+      with open(file_path, "rb") as f:
+        message = await bot.send_document(
+            chat_id,
+            document=f,
+            filename=os.path.basename(file_path),
+            **kwargs,
+        )
+      self.set(bot.id, digest, file_path, message.document.file_id)
+      try:
+        await asyncio.to_thread(self._save)
+      except OSError as exc:
+        # The document was delivered; only the persisted cache is stale.
+        logger.warning("Could not save file_id cache: %s", exc)
+      return message
@@ -0,0 +1,197 @@
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimitFilter(logging.Filter):
+  """Token-bucket sampling of noisy loggers.
+
+  `rates` maps a logger name prefix (e.g. "httpx") to the number of records
+  per second let through. Warnings and above are never sampled out. The next
+  record that passes carries `sampled_out`, the count suppressed before it.
+  """
+
+  def __init__(self, rates):
+    super().__init__()
+    self._rates = sorted(rates.items(), key=lambda item: -len(item[0]))
+    self._buckets = {}
+    self._lock = threading.Lock()
+
+  def _rate_for(self, name):
+    for prefix, rate in self._rates:
+      if name == prefix or name.startswith(prefix + "."):
+        return prefix, rate
+    return None, None
+
+  def filter(self, record):
+    if record.levelno >= logging.WARNING:
+      return True
+    prefix, rate = self._rate_for(record.name)
+    if prefix is None:
+      return True
+
+    now = time.monotonic()
+    capacity = max(rate, 1.0)
+    with self._lock:
+      # A new bucket starts full, so the first record always gets through.
+      tokens, last, suppressed = self._buckets.get(prefix, (capacity, now, 0))
+      tokens = min(capacity, tokens + (now - last) * rate)
+      if tokens < 1:
+        self._buckets[prefix] = (tokens, now, suppressed + 1)
+        return False
+      self._buckets[prefix] = (tokens - 1, now, 0)
+    if suppressed:
+      record.sampled_out = suppressed
+    return True
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+  """QueueHandler that never blocks; records are dropped if the queue is full."""
+
+  def __init__(self, log_queue):
+    super().__init__(log_queue)
+    self.dropped = 0
+    self._lock = threading.Lock()
+
+  def prepare(self, record):
+    # Formatting happens on the writer thread; only snapshot the message so
+    # later mutation of the args cannot change it. Other handlers may still
+    # see this record, so change a copy.
+    msg = record.getMessage()
+    record = copy.copy(record)
+    record.msg = msg
+    record.args = None
+    return record
+
+  def enqueue(self, record):
+    try:
+      self.queue.put_nowait(record)
+    except queue.Full:
+      with self._lock:
+        self.dropped += 1
+
+
+class _ReportingListener(logging.handlers.QueueListener):
+
+  def __init__(self, log_queue, source, *handlers):
+    super().__init__(log_queue, *handlers, respect_handler_level=True)
+    self._source = source
+    self._reported = 0
+
+  def handle(self, record):
+    dropped = self._source.dropped
+    if dropped > self._reported:
+      notice = logging.makeLogRecord({
+          "name": __name__,
+          "levelno": logging.WARNING,
+          "levelname": "WARNING",
+          "msg": f"Dropped {dropped - self._reported} log records (queue full)",
+      })
+      self._reported = dropped
+      super().handle(notice)
+    super().handle(record)
+
+  def enqueue_sentinel(self):
+    # Block rather than fail when stopping with a full queue.
+    self.queue.put(self._sentinel)
+
+
+class JsonFormatter(logging.Formatter):
+
+  def format(self, record):
+    entry = {
+        "ts": self.formatTime(record),
+        "level": record.levelname,
+        "logger": record.name,
+        "msg": record.getMessage(),
+        "process": record.processName,
+        "thread": record.threadName,
+    }
+    if getattr(record, "sampled_out", 0):
+      entry["sampled_out"] = record.sampled_out
+    if record.exc_info:
+      entry["exc"] = self.formatException(record.exc_info)
+    return json.dumps(entry, ensure_ascii=False)
+
+
+def parse_sample_rates(spec):
+  """Parse "httpx=1,telegram.ext=5" into {"httpx": 1.0, "telegram.ext": 5.0}.
+
+  Malformed entries and rates that are not positive are skipped with a
+  warning.
+  """
+  rates = {}
+  for item in filter(None, (part.strip() for part in spec.split(","))):
+    name, _, rate = item.partition("=")
+    try:
+      rate = float(rate)
+    except ValueError:
+      rate = None
+    if not name.strip() or rate is None or not rate > 0:
+      logger.warning("Ignoring invalid log sample rate %r", item)
+      continue
+    rates[name.strip()] = rate
+  return rates
+
+
+def setup_logging(
+    level=logging.INFO, fmt="json", queue_size=10000, sample_rates=None
+):
+  """Route all logging through a bounded queue drained by a writer thread.
+
+  `level` and `queue_size` may be strings (e.g. from the environment), and
+  `sample_rates` a spec for parse_sample_rates(). Invalid settings fall back
+  to the defaults with a warning rather than failing.
+
+  Returns the queue handler, whose `dropped` attribute counts records lost
+  because the queue was full.
+  """
+  problems = []
+  try:
+    queue_size = int(queue_size)
+  except (TypeError, ValueError):
+    problems.append(f"Invalid log queue size {queue_size!r}, using 10000")
+    queue_size = 10000
+
+  log_queue = queue.Queue(maxsize=queue_size)
+  handler = DroppingQueueHandler(log_queue)
+
+  stream = logging.StreamHandler(sys.stderr)
+  if fmt == "json":
+    stream.setFormatter(JsonFormatter())
+  else:
+    stream.setFormatter(
+        logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    )
+
+  root = logging.getLogger()
+  for existing in root.handlers[:]:
+    root.removeHandler(existing)
+  root.addHandler(handler)
+  if isinstance(level, str):
+    level = level.upper()
+  try:
+    root.setLevel(level)
+  except (TypeError, ValueError):
+    problems.append(f"Invalid log level {level!r}, using INFO")
+    root.setLevel(logging.INFO)
+
+  listener = _ReportingListener(log_queue, handler, stream)
+  listener.start()
+  atexit.register(listener.stop)
+
+  for problem in problems:
+    logger.warning(problem)
+  if isinstance(sample_rates, str):
+    sample_rates = parse_sample_rates(sample_rates)
+  if sample_rates:
+    handler.addFilter(RateLimitFilter(sample_rates))
+  return handler
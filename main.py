@@ -1,10 +1,19 @@
 import asyncio
+import concurrent.futures
+import hashlib
+import hmac
+import json
 import logging
+import multiprocessing
 import os
-from threading import Thread
+import queue
+import re
+from threading import Event, Thread
 
-from flask import Flask
-from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
+from flask import Flask, request
+from razorpay.errors import BadRequestError
+from telegram import Bot, InlineKeyboardButton, InlineKeyboardMarkup, Update
+from telegram.error import TimedOut
 from telegram.ext import (
     Application,
     CallbackQueryHandler,
@@ -12,15 +21,74 @@ from telegram.ext import (
     ContextTypes,
 )
 
-# Enable logging
-logging.basicConfig(
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    level=logging.INFO,
+from file_cache import FileIdCache
+from logs import setup_logging
+from multibot import bot_metrics, load_bot_configs, run_bots
+from payments import RazorpayGateway
+from sharding import (
+    CallInterrupted,
+    ShardedDispatcher,
+    poll_updates,
+    run_worker,
+)
+from webhooks import BUSY, DUPLICATE, DeliveryUncertain, WebhookInbox
+
+# Enable logging: records are queued and written by a background thread, and
+# per-request logs from noisy loggers (e.g. httpx) are sampled
+log_handler = setup_logging(
+    level=os.environ.get("LOG_LEVEL", "INFO"),
+    fmt=os.environ.get("LOG_FORMAT", "json"),
+    queue_size=os.environ.get("LOG_QUEUE_SIZE", 10000),
+    sample_rates=os.environ.get("LOG_SAMPLE_RATES", "httpx=1,telegram.ext=5"),
 )
 logger = logging.getLogger(__name__)
 
 # Fetch environment variables
 BOT_TOKEN = os.environ.get("TELEGRAM_BOT_TOKEN")
+RAZORPAY_WEBHOOK_SECRET = os.environ.get("RAZORPAY_WEBHOOK_SECRET")
+
+# Number of update worker processes; 1 keeps everything on the bot thread
+BOT_WORKERS = int(os.environ.get("BOT_WORKERS", 1))
+BOT_WORKER_QUEUE_SIZE = int(os.environ.get("BOT_WORKER_QUEUE_SIZE", 100))
+# Public URL of /telegram/webhook; when unset, updates are long-polled
+TELEGRAM_WEBHOOK_URL = os.environ.get("TELEGRAM_WEBHOOK_URL")
+TELEGRAM_WEBHOOK_SECRET = os.environ.get("TELEGRAM_WEBHOOK_SECRET")
+
+# Path to a JSON file listing the bots to host in one process (see
+# multibot.load_bot_configs); when set, it replaces TELEGRAM_BOT_TOKEN
+BOTS_CONFIG = os.environ.get("BOTS_CONFIG")
+BOTS_POOL_SIZE = int(os.environ.get("BOTS_POOL_SIZE", 64))
+# Bearer token required by /metrics; the route is disabled when unset
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
+SAMPLES_DIR = os.environ.get("SAMPLES_DIR", "samples")
+FILE_ID_CACHE_PATH = os.environ.get("FILE_ID_CACHE_PATH", "file_id_cache.json")
+
+# Free sample PDFs sent directly in chat: callback key -> (stream, label, file)
+SAMPLE_PAPERS = {
+    "sample_pilot_met": ("PILOT", "🌤️ Meteorology Sample", "pilot_met.pdf"),
+    "sample_pilot_nav": ("PILOT", "🧭 Air Navigation Sample", "pilot_nav.pdf"),
+    "sample_pilot_reg": ("PILOT", "📜 Air Regulation Sample", "pilot_reg.pdf"),
+    "sample_pilot_tech": ("PILOT", "⚙️ Technical General Sample", "pilot_tech.pdf"),
+    "sample_ame_m3": ("AME", "Module 3 Sample", "ame_module_3.pdf"),
+    "sample_ame_m4": ("AME", "Module 4 Sample", "ame_module_4.pdf"),
+}
+
+file_id_cache = FileIdCache(FILE_ID_CACHE_PATH)
+payment_gateway = RazorpayGateway.from_env()
+
+ORDER_ID_PATTERN = re.compile(r"^order_[A-Za-z0-9]+$")
+# Orders remembered per user for /mypurchases; each one is a Razorpay lookup
+MAX_TRACKED_ORDERS = 20
+ORDER_STATUS_LABELS = {
+    "created": "⏳ Awaiting payment",
+    "attempted": "⚠️ Payment attempted",
+    "paid": "✅ Paid",
+}
+
+# Loop and Application of the running bot (or the ShardedDispatcher in
+# multi-process mode), used to send messages from other threads
+bot_runtime = {}
+bot_ready = Event()
 
 # Initialize Flask App
 app = Flask(__name__)
@@ -36,7 +104,87 @@ def health():
   return "OK", 200
 
 
+@app.route("/metrics")
+def metrics():
+  if not METRICS_TOKEN:
+    return "Metrics not configured", 404
+
+  auth = request.headers.get("Authorization", "")
+  if not hmac.compare_digest(auth, f"Bearer {METRICS_TOKEN}"):
+    return "Invalid token", 403
+
+  return {
+      "bots": {name: m.as_dict() for name, m in bot_metrics.items()},
+      "log_records_dropped": log_handler.dropped,
+  }, 200
+
+
+@app.route("/telegram/webhook", methods=["POST"])
+def telegram_webhook():
+  dispatcher = bot_runtime.get("dispatcher")
+  if dispatcher is None or not TELEGRAM_WEBHOOK_URL:
+    return "Webhook not configured", 404
+
+  # Telegram echoes the secret_token passed to setWebhook on every request.
+  secret = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+  if not hmac.compare_digest(secret, TELEGRAM_WEBHOOK_SECRET or ""):
+    return "Invalid secret", 403
+
+  try:
+    dispatcher.dispatch(Update.de_json(request.get_json(), None), timeout=5)
+  except queue.Full:
+    # Telegram retries, so a full shard just slows ingestion down.
+    return "Busy, retry later", 503
+  return "OK", 200
+
+
+@app.route("/webhooks/razorpay", methods=["POST"])
+def razorpay_webhook():
+  if razorpay_inbox is None:
+    return "Webhook not configured", 404
+
+  body = request.get_data()
+  signature = request.headers.get("X-Razorpay-Signature")
+  if not razorpay_inbox.verify(body, signature):
+    return "Invalid signature", 400
+
+  try:
+    event = json.loads(body)
+  except ValueError:
+    return "Invalid payload", 400
+
+  event_id = (
+      request.headers.get("X-Razorpay-Event-Id")
+      or hashlib.sha256(body).hexdigest()
+  )
+  result = razorpay_inbox.submit(event_id, event)
+  if result == BUSY:
+    return "Busy, retry later", 503
+  if result == DUPLICATE:
+    logger.info("Ignoring duplicate Razorpay event %s", event_id)
+  return "OK", 200
+
+
+def format_rupees(paise):
+  return f"₹{paise // 100:,}.{paise % 100:02d}"
+
+
 # Navigation & Keyboards
+def get_stream(context):
+  # Audience bots (see BOTS_CONFIG) default to their own stream.
+  default_stream = context.bot_data.get("stream") or "PILOT"
+  return context.user_data.get("stream", default_stream)
+
+
+def get_sample_papers(stream):
+  return [
+      (key, label, os.path.join(SAMPLES_DIR, filename))
+      for key, (paper_stream, label, filename) in SAMPLE_PAPERS.items()
+      if paper_stream == stream
+      and os.path.isfile(os.path.join(SAMPLES_DIR, filename))
+  ]
+
+
 def get_footer_buttons():
   return [
       [InlineKeyboardButton("🌐 Main Website", url="https://examairways.com/")],
@@ -52,12 +200,19 @@ def get_footer_buttons():
 
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-  keyboard = [
-      [
-          InlineKeyboardButton("🛠️ AME", callback_data="stream_ame"),
-          InlineKeyboardButton("✈️ PILOT", callback_data="stream_pilot"),
-      ]
-  ] + get_footer_buttons()
+  stream_buttons = [
+      InlineKeyboardButton("🛠️ AME", callback_data="stream_ame"),
+      InlineKeyboardButton("✈️ PILOT", callback_data="stream_pilot"),
+  ]
+  bot_stream = context.bot_data.get("stream")
+  if bot_stream:
+    stream_buttons = [
+        button
+        for button in stream_buttons
+        if button.callback_data == f"stream_{bot_stream.lower()}"
+    ]
+
+  keyboard = [stream_buttons] + get_footer_buttons()
 
   reply_markup = InlineKeyboardMarkup(keyboard)
   welcome_text = (
@@ -142,7 +297,7 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     )
 
   elif data == "authority_dgca":
-    stream = context.user_data.get("stream", "PILOT")
+    stream = get_stream(context)
 
     keyboard = [[
         InlineKeyboardButton(
@@ -162,6 +317,13 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
           )
       ])
 
+    if get_sample_papers(stream):
+      keyboard.append([
+          InlineKeyboardButton(
+              "🆓 Free Sample Papers", callback_data="opt_samples"
+          )
+      ])
+
     keyboard.append(
         [InlineKeyboardButton("🔍 Just Exploring", callback_data="opt_exploring")]
     )
@@ -177,7 +339,7 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     )
 
   elif data == "opt_raw_materials":
-    stream = context.user_data.get("stream", "PILOT")
+    stream = get_stream(context)
 
     if stream == "PILOT":
       keyboard = [
@@ -316,6 +478,44 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         parse_mode="Markdown",
     )
 
+  elif data == "opt_samples":
+    stream = get_stream(context)
+
+    keyboard = [
+        [InlineKeyboardButton(label, callback_data=key)]
+        for key, label, _ in get_sample_papers(stream)
+    ]
+    keyboard.append([
+        InlineKeyboardButton(
+            "🔙 Back to DGCA Menu", callback_data="authority_dgca"
+        )
+    ])
+    keyboard.extend(get_footer_buttons())
+
+    await query.edit_message_text(
+        text=(
+            f"🆓 **{stream} Free Sample Papers**\n\nTap a paper to receive the"
+            " PDF right here in chat:"
+        ),
+        reply_markup=InlineKeyboardMarkup(keyboard),
+        parse_mode="Markdown",
+    )
+
+  elif data in SAMPLE_PAPERS:
+    _, label, filename = SAMPLE_PAPERS[data]
+    file_path = os.path.join(SAMPLES_DIR, filename)
+
+    if not os.path.isfile(file_path):
+      logger.warning("Sample paper %s is missing", file_path)
+      await query.message.reply_text(
+          "This sample is not available right now. Please try again later."
+      )
+      return
+
+    await file_id_cache.send_document(
+        context.bot, query.message.chat_id, file_path, caption=label
+    )
+
   elif data == "opt_ebooks_menu":
     keyboard = [
         [
@@ -769,28 +969,290 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     await start(update, context)
 
 
+async def my_purchases(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+  # CommandHandler also matches edited messages, where update.message is None.
+  message = update.effective_message
+  if payment_gateway is None:
+    await message.reply_text(
+        "Purchase lookups are not available right now. Please email"
+        " examairways@gmail.com for help."
+    )
+    return
+
+  if len(context.args) > MAX_TRACKED_ORDERS:
+    await message.reply_text(
+        f"Please send at most {MAX_TRACKED_ORDERS} order ids at a time."
+    )
+    return
+
+  for arg in context.args:
+    if not ORDER_ID_PATTERN.match(arg):
+      await message.reply_text(
+          f"`{arg}` is not a valid order id. It should look like"
+          " `order_XXXXXXXXXXXXXX`.",
+          parse_mode="Markdown",
+      )
+      return
+
+  stored_ids = context.user_data.get("order_ids", [])
+  order_ids = list(dict.fromkeys(stored_ids + context.args))
+  order_ids = order_ids[-MAX_TRACKED_ORDERS:]
+
+  if not order_ids:
+    await message.reply_text(
+        "🧾 **My Purchases**\n\nNo purchases found yet. Send"
+        " `/mypurchases <order id>` with the order id from your payment"
+        " receipt to check its status.",
+        parse_mode="Markdown",
+    )
+    return
+
+  orders = await payment_gateway.fetch_orders(order_ids)
+
+  # Only orders placed from this Telegram account are shown and remembered.
+  user_id = str(update.effective_user.id)
+  lines = ["🧾 **My Purchases**\n"]
+  kept_ids = []
+  for order_id, order in orders.items():
+    if isinstance(order, Exception) and not isinstance(order, BadRequestError):
+      # Transient (network/server) failure: keep the id and try again later.
+      logger.warning("Razorpay lookup for %s failed: %s", order_id, order)
+      lines.append(f"`{order_id}`\n❓ Could not fetch status")
+      kept_ids.append(order_id)
+      continue
+
+    # Unknown ids are reported exactly like other users' orders, so the reply
+    # does not reveal whether an order exists.
+    notes = {} if isinstance(order, Exception) else order.get("notes") or {}
+    if str(notes.get("telegram_user_id")) != user_id:
+      lines.append(f"`{order_id}`\n🚫 Not found for your account")
+      continue
+
+    status = ORDER_STATUS_LABELS.get(order["status"], order["status"])
+    lines.append(f"`{order_id}` – {format_rupees(order['amount'])}\n{status}")
+    kept_ids.append(order_id)
+
+  context.user_data["order_ids"] = kept_ids
+  await message.reply_text("\n\n".join(lines), parse_mode="Markdown")
+
+
+async def deliver_payment_access(application, event):
+  payment = event["payload"]["payment"]["entity"]
+  if payment_gateway is not None:
+    payment_gateway.prime("payment", payment["id"], payment)
+    if payment.get("order_id"):
+      payment_gateway.invalidate("order", payment["order_id"])
+
+  notes = payment.get("notes") or {}
+  chat_id = notes.get("telegram_user_id")
+  if not chat_id:
+    logger.info("Payment %s has no telegram_user_id note", payment["id"])
+    return
+
+  order_id = payment.get("order_id")
+  if order_id:
+    user_data = application.user_data[int(chat_id)]
+    order_ids = user_data.get("order_ids", [])
+    if order_id not in order_ids:
+      user_data["order_ids"] = (order_ids + [order_id])[-MAX_TRACKED_ORDERS:]
+
+  keyboard = []
+  if notes.get("access_url"):
+    keyboard.append(
+        [InlineKeyboardButton("🔓 Access Your Content", url=notes["access_url"])]
+    )
+  keyboard.extend(get_footer_buttons())
+
+  reference = f"`{order_id or payment['id']}`"
+  await application.bot.send_message(
+      chat_id=int(chat_id),
+      text=(
+          "✅ **Payment Received!**\n\nThank you for your purchase of"
+          f" {format_rupees(payment['amount'])}.\nReference: {reference}\n\nUse"
+          " /mypurchases anytime to check your orders."
+      ),
+      reply_markup=InlineKeyboardMarkup(keyboard),
+      parse_mode="Markdown",
+  )
+
+
+def handle_razorpay_event(event):
+  # Runs on the webhook worker thread; hand the work to the bot's event loop.
+  if event.get("event") != "payment.captured":
+    return
+
+  if not bot_ready.wait(timeout=30):
+    raise RuntimeError("Telegram bot is not running")
+
+  notes = event["payload"]["payment"]["entity"].get("notes") or {}
+  if "dispatcher" in bot_runtime:
+    # Deliver on the worker that owns this user's chat and user_data; the
+    # future reports the worker's outcome.
+    key = int(notes.get("telegram_user_id") or 0)
+    future = bot_runtime["dispatcher"].call(
+        key, deliver_payment_access, event, timeout=30
+    )
+  else:
+    # In multi-bot mode, a "bot" note picks which bot sends the message.
+    application = bot_runtime.get("applications", {}).get(
+        notes.get("bot"), bot_runtime["application"]
+    )
+    future = asyncio.run_coroutine_threadsafe(
+        deliver_payment_access(application, event), bot_runtime["loop"]
+    )
+
+  try:
+    future.result(timeout=30)
+  except concurrent.futures.TimeoutError as exc:
+    future.cancel()
+    raise DeliveryUncertain("Access message still pending") from exc
+  except TimedOut as exc:
+    # Telegram may have delivered the message before the request timed out.
+    raise DeliveryUncertain("Access message timed out") from exc
+  except CallInterrupted as exc:
+    raise DeliveryUncertain("Worker exited while sending access") from exc
+
+
+def describe_razorpay_event(event):
+  try:
+    payment = event["payload"]["payment"]["entity"]
+    return f"payment {payment['id']}, order {payment.get('order_id')}"
+  except (KeyError, TypeError):
+    return "no payment entity"
+
+
+razorpay_inbox = (
+    WebhookInbox(
+        RAZORPAY_WEBHOOK_SECRET,
+        handle_razorpay_event,
+        describe=describe_razorpay_event,
+    )
+    if RAZORPAY_WEBHOOK_SECRET
+    else None
+)
+
+
+async def register_runtime(application: Application) -> None:
+  bot_runtime.update(loop=asyncio.get_running_loop(), application=application)
+  bot_ready.set()
+
+
+def build_application(token, **builder_options):
+  builder = Application.builder().token(token).post_init(register_runtime)
+  for option, value in builder_options.items():
+    builder = getattr(builder, option)(value)
+
+  application = builder.build()
+  application.add_handler(CommandHandler("start", start))
+  application.add_handler(CommandHandler("mypurchases", my_purchases))
+  application.add_handler(CallbackQueryHandler(button_handler))
+  return application
+
+
+async def set_telegram_webhook():
+  async with Bot(BOT_TOKEN) as bot:
+    await bot.set_webhook(
+        TELEGRAM_WEBHOOK_URL,
+        secret_token=TELEGRAM_WEBHOOK_SECRET,
+        allowed_updates=Update.ALL_TYPES,
+        drop_pending_updates=True,
+    )
+
+
+def run_sharded_bot():
+  if TELEGRAM_WEBHOOK_URL and not TELEGRAM_WEBHOOK_SECRET:
+    logger.error(
+        "TELEGRAM_WEBHOOK_SECRET is required when TELEGRAM_WEBHOOK_URL is set!"
+    )
+    return
+
+  dispatcher = ShardedDispatcher(
+      BOT_WORKERS,
+      run_worker,
+      worker_args=(BOT_TOKEN, build_application),
+      queue_size=BOT_WORKER_QUEUE_SIZE,
+  )
+  dispatcher.start()
+  bot_runtime["dispatcher"] = dispatcher
+  bot_ready.set()
+
+  logger.info("Telegram Bot started with %s worker processes", BOT_WORKERS)
+
+  if TELEGRAM_WEBHOOK_URL:
+    asyncio.run(set_telegram_webhook())
+  else:
+    asyncio.run(poll_updates(BOT_TOKEN, dispatcher))
+
+
+async def register_bots(applications):
+  if applications:
+    bot_runtime.update(
+        loop=asyncio.get_running_loop(),
+        application=next(iter(applications.values())),
+        applications=applications,
+    )
+    bot_ready.set()
+
+
+def run_multi_bot():
+  try:
+    bots = load_bot_configs(BOTS_CONFIG)
+  except (OSError, KeyError, ValueError) as exc:
+    logger.error("Invalid BOTS_CONFIG: %s", exc)
+    return
+  if not bots:
+    logger.error("No usable bots found in %s", BOTS_CONFIG)
+    return
+  if BOT_WORKERS > 1:
+    logger.warning("BOT_WORKERS is ignored when BOTS_CONFIG is set")
+
+  logger.info("Starting %s bots on one event loop", len(bots))
+  asyncio.run(
+      run_bots(
+          bots,
+          build_application,
+          on_started=register_bots,
+          pool_size=BOTS_POOL_SIZE,
+      )
+  )
+
+
 def run_telegram_bot():
+  if BOTS_CONFIG:
+    run_multi_bot()
+    return
+
   if not BOT_TOKEN:
     logger.error("TELEGRAM_BOT_TOKEN environment variable is missing!")
     return
 
+  if BOT_WORKERS > 1:
+    run_sharded_bot()
+    return
+
   # Create a dedicated asyncio event loop for this background thread
   loop = asyncio.new_event_loop()
   asyncio.set_event_loop(loop)
 
-  application = Application.builder().token(BOT_TOKEN).build()
-  application.add_handler(CommandHandler("start", start))
-  application.add_handler(CallbackQueryHandler(button_handler))
+  application = build_application(BOT_TOKEN)
 
   logger.info("Telegram Bot Polling Started...")
 
   # CRITICAL FIX: stop_signals=None prevents the thread/signal handler error on Gunicorn/Render
   application.run_polling(drop_pending_updates=True, stop_signals=None)
 
+  if payment_gateway is not None:
+    payment_gateway.close()
+
+
+# Start Telegram Bot thread automatically when server starts. Worker processes
+# re-import this module, so only the parent process starts the bot.
+if multiprocessing.parent_process() is None:
+  bot_thread = Thread(target=run_telegram_bot, daemon=True)
+  bot_thread.start()
 
-# Start Telegram Bot thread automatically when server starts
-bot_thread = Thread(target=run_telegram_bot, daemon=True)
-bot_thread.start()
+  if razorpay_inbox is not None:
+    razorpay_inbox.start()
 
 if __name__ == "__main__":
   port = int(os.environ.get("PORT", 8080))
@@ -0,0 +1,213 @@
+import asyncio
+import datetime
+import json
+import logging
+import os
+import time
+
+from telegram import Update
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter, TypeHandler
+from telegram.request import BaseRequest, HTTPXRequest
+
+logger = logging.getLogger(__name__)
+
+# Per-bot counters, keyed by bot name; read by the /metrics endpoint
+bot_metrics = {}
+
+# Audiences a bot can default new users to (see main.get_stream)
+STREAMS = ("AME", "PILOT")
+
+
+class BotMetrics:
+
+  def __init__(self):
+    self.updates = 0
+    self.api_calls = 0
+    self.throttled = 0
+    self.retry_after = 0
+    self.started_at = time.time()
+
+  def as_dict(self):
+    return dict(vars(self))
+
+
+class SharedRequest(BaseRequest):
+  """Lets several bots use one HTTPXRequest (and its connection pool).
+
+  The underlying client is opened by the first bot to initialize and closed
+  when the last one shuts down.
+  """
+
+  def __init__(self, request):
+    self._request = request
+    self.users = 0
+
+  @property
+  def read_timeout(self):
+    return self._request.read_timeout
+
+  async def initialize(self):
+    self.users += 1
+    if self.users == 1:
+      await self._request.initialize()
+
+  async def shutdown(self):
+    self.users -= 1
+    if self.users == 0:
+      await self._request.shutdown()
+
+  async def do_request(self, *args, **kwargs):
+    return await self._request.do_request(*args, **kwargs)
+
+
+class BotRateLimiter(BaseRateLimiter):
+  """Per-bot limit of outgoing API calls per second, with a small burst.
+
+  getUpdates is never delayed. A RetryAfter from Telegram is waited out and
+  the call retried once.
+  """
+
+  def __init__(self, metrics, rate=25.0, burst=5):
+    self.metrics = metrics
+    self._interval = 1.0 / rate
+    self._tolerance = self._interval * max(burst - 1, 0)
+    self._next_at = 0.0
+
+  async def initialize(self):
+    pass
+
+  async def shutdown(self):
+    pass
+
+  async def process_request(
+      self, callback, args, kwargs, endpoint, data, rate_limit_args
+  ):
+    self.metrics.api_calls += 1
+    if endpoint != "getUpdates":
+      now = time.monotonic()
+      self._next_at = max(self._next_at, now)
+      delay = self._next_at - now - self._tolerance
+      self._next_at += self._interval
+      if delay > 0:
+        self.metrics.throttled += 1
+        await asyncio.sleep(delay)
+
+    try:
+      return await callback(*args, **kwargs)
+    except RetryAfter as exc:
+      self.metrics.retry_after += 1
+      retry_after = exc.retry_after
+      if isinstance(retry_after, datetime.timedelta):
+        retry_after = retry_after.total_seconds()
+      await asyncio.sleep(retry_after)
+      return await callback(*args, **kwargs)
+
+
+def load_bot_configs(path):
+  """Read the bot list, e.g.
+
+  [{"name": "ame", "token_env": "AME_BOT_TOKEN", "stream": "AME",
+    "rate_limit": 25}]
+
+  Each entry needs a unique "name" and either "token" or "token_env". The
+  optional "stream" (AME or PILOT, in any case) is returned upper-cased.
+  Raises OSError if the file cannot be read and ValueError if it is not a
+  list of such entries, has duplicate names or an unknown stream.
+  """
+  with open(path, encoding="utf-8") as f:
+    configs = json.load(f)
+
+  if not isinstance(configs, list):
+    raise ValueError(f"{path} must contain a JSON list of bots")
+  for index, config in enumerate(configs):
+    if not isinstance(config, dict) or not isinstance(config.get("name"), str):
+      raise ValueError(f"Bot #{index + 1} in {path} has no \"name\"")
+    stream = config.get("stream")
+    if stream is not None:
+      if not isinstance(stream, str) or stream.upper() not in STREAMS:
+        raise ValueError(
+            f"Bot {config['name']} has unknown stream {stream!r}"
+            f" (expected one of {', '.join(STREAMS)})"
+        )
+      config["stream"] = stream.upper()
+
+  names = [config["name"] for config in configs]
+  duplicates = sorted({name for name in names if names.count(name) > 1})
+  if duplicates:
+    raise ValueError(f"Duplicate bot names in {path}: {', '.join(duplicates)}")
+
+  bots = []
+  for config in configs:
+    token = config.get("token") or os.environ.get(config.get("token_env", ""))
+    if not token:
+      logger.error("No token configured for bot %s, skipping", config["name"])
+      continue
+    bots.append(dict(config, token=token))
+  return bots
+
+
+async def _count_update(update, context):
+  bot_metrics[context.bot_data["name"]].updates += 1
+
+
+async def run_bots(bots, build_application, on_started=None, pool_size=64):
+  """Poll all `bots` on the current event loop until cancelled.
+
+  Every Application is built with `build_application(token, **options)` and
+  shares one HTTP connection pool for API calls, while getting its own rate
+  limiter and metrics. `on_started(applications)` is awaited once all bots
+  are running.
+  """
+  shared_request = SharedRequest(
+      HTTPXRequest(connection_pool_size=pool_size)
+  )
+  applications = {}
+
+  try:
+    for bot in bots:
+      name = bot["name"]
+      metrics = bot_metrics.setdefault(name, BotMetrics())
+      get_updates_request = HTTPXRequest()
+      application = build_application(
+          bot["token"],
+          request=shared_request,
+          get_updates_request=get_updates_request,
+          rate_limiter=BotRateLimiter(metrics, rate=bot.get("rate_limit", 25)),
+      )
+      application.bot_data.update(name=name, stream=bot.get("stream"))
+      application.add_handler(TypeHandler(Update, _count_update), group=-1)
+
+      shared_users = shared_request.users
+      initialized = False
+      try:
+        await application.initialize()
+        initialized = True
+        await application.updater.start_polling(drop_pending_updates=True)
+        await application.start()
+      except Exception:
+        logger.exception("Could not start bot %s", name)
+        if initialized:
+          if application.updater.running:
+            await application.updater.stop()
+          await application.shutdown()
+        else:
+          # shutdown() is a no-op after a failed initialize(), so release
+          # this bot's hold on the HTTP clients directly.
+          await get_updates_request.shutdown()
+          if shared_request.users > shared_users:
+            await shared_request.shutdown()
+        continue
+      applications[name] = application
+      logger.info("Bot %s (@%s) polling started", name, application.bot.username)
+
+    if on_started:
+      await on_started(applications)
+    await asyncio.Event().wait()
+  finally:
+    for application in applications.values():
+      if application.updater.running:
+        await application.updater.stop()
+      if application.running:
+        await application.stop()
+      await application.shutdown()
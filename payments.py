@@ -0,0 +1,145 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import razorpay
+
+logger = logging.getLogger(__name__)
+
+# Order/payment states that can no longer change and are safe to cache.
+SETTLED_ORDER_STATES = {"paid"}
+SETTLED_PAYMENT_STATES = {"captured", "refunded", "failed"}
+
+
+class RazorpayGateway:
+  """Async facade over the synchronous Razorpay SDK.
+
+  SDK calls run on a bounded thread pool so they never block the event loop.
+  Concurrent lookups of the same object share one request, and settled
+  states are cached for `cache_ttl` seconds.
+  """
+
+  def __init__(
+      self,
+      key_id,
+      key_secret,
+      base_url=None,
+      max_workers=4,
+      cache_ttl=600,
+      cache_size=1024,
+      batch_size=10,
+  ):
+    self._auth = (key_id, key_secret)
+    self._options = {"base_url": base_url} if base_url else {}
+    self._local = threading.local()
+    self._executor = ThreadPoolExecutor(
+        max_workers=max_workers, thread_name_prefix="razorpay"
+    )
+    self._inflight = {}
+    self._cache = OrderedDict()
+    self.cache_ttl = cache_ttl
+    self.cache_size = cache_size
+    self.batch_size = batch_size
+
+  @classmethod
+  def from_env(cls):
+    key_id = os.environ.get("RAZORPAY_KEY_ID")
+    key_secret = os.environ.get("RAZORPAY_KEY_SECRET")
+    if not key_id or not key_secret:
+      return None
+    return cls(
+        key_id,
+        key_secret,
+        base_url=os.environ.get("RAZORPAY_BASE_URL"),
+        max_workers=int(os.environ.get("RAZORPAY_MAX_WORKERS", 4)),
+        cache_ttl=float(os.environ.get("RAZORPAY_CACHE_TTL", 600)),
+    )
+
+  def _client(self):
+    # requests.Session is not thread-safe, so each pool thread gets its own.
+    client = getattr(self._local, "client", None)
+    if client is None:
+      client = razorpay.Client(auth=self._auth, **self._options)
+      self._local.client = client
+    return client
+
+  def _cached(self, key):
+    entry = self._cache.get(key)
+    if entry is None:
+      return None
+    expires_at, value = entry
+    if expires_at < time.monotonic():
+      del self._cache[key]
+      return None
+    self._cache.move_to_end(key)
+    return value
+
+  def _store(self, key, value):
+    self._cache[key] = (time.monotonic() + self.cache_ttl, value)
+    self._cache.move_to_end(key)
+    while len(self._cache) > self.cache_size:
+      self._cache.popitem(last=False)
+
+  def invalidate(self, kind, object_id):
+    self._cache.pop((kind, object_id), None)
+
+  def prime(self, kind, object_id, value):
+    """Seed the cache with an entity received elsewhere (e.g. a webhook)."""
+    if value.get("status") in self._settled_states(kind):
+      self._store((kind, object_id), value)
+    else:
+      self.invalidate(kind, object_id)
+
+  @staticmethod
+  def _settled_states(kind):
+    return SETTLED_ORDER_STATES if kind == "order" else SETTLED_PAYMENT_STATES
+
+  async def _lookup(self, kind, object_id, fetch):
+    key = (kind, object_id)
+    cached = self._cached(key)
+    if cached is not None:
+      return cached
+
+    task = self._inflight.get(key)
+    if task is None:
+      loop = asyncio.get_running_loop()
+      task = loop.run_in_executor(self._executor, fetch, object_id)
+      self._inflight[key] = task
+      task.add_done_callback(lambda _: self._inflight.pop(key, None))
+    value = await asyncio.shield(task)
+
+    if value.get("status") in self._settled_states(kind):
+      self._store(key, value)
+    return value
+
+  async def fetch_order(self, order_id):
+    return await self._lookup(
+        "order", order_id, lambda oid: self._client().order.fetch(oid)
+    )
+
+  async def fetch_payment(self, payment_id):
+    return await self._lookup(
+        "payment", payment_id, lambda pid: self._client().payment.fetch(pid)
+    )
+
+  async def fetch_orders(self, order_ids):
+    """Fetch many orders, at most `batch_size` requests at a time.
+
+    Returns {order_id: order dict or the exception raised for it}.
+    """
+    results = {}
+    order_ids = list(dict.fromkeys(order_ids))
+    for i in range(0, len(order_ids), self.batch_size):
+      batch = order_ids[i:i + self.batch_size]
+      fetched = await asyncio.gather(
+          *(self.fetch_order(oid) for oid in batch), return_exceptions=True
+      )
+      results.update(zip(batch, fetched))
+    return results
+
+  def close(self):
+    self._executor.shutdown(wait=False, cancel_futures=True)
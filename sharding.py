@@ -0,0 +1,312 @@
+import asyncio
+import bisect
+import concurrent.futures
+import hashlib
+import itertools
+import logging
+import multiprocessing
+import pickle
+import queue
+import threading
+import time
+import weakref
+
+from telegram import Bot, Update
+from telegram.error import TelegramError
+
+logger = logging.getLogger(__name__)
+
+
+def _hash(key):
+  digest = hashlib.blake2b(key.encode(), digest_size=8).digest()
+  return int.from_bytes(digest, "big")
+
+
+class HashRing:
+  """Consistent hash ring mapping keys (chat ids) to worker shards."""
+
+  def __init__(self, nodes, replicas=64):
+    points = sorted(
+        (_hash(f"{node}:{i}"), node) for node in nodes for i in range(replicas)
+    )
+    self._hashes = [h for h, _ in points]
+    self._nodes = [node for _, node in points]
+
+  def node_for(self, key):
+    index = bisect.bisect(self._hashes, _hash(str(key))) % len(self._hashes)
+    return self._nodes[index]
+
+
+class WorkerLost(Exception):
+  """The worker handling a call exited before starting it."""
+
+
+class CallInterrupted(Exception):
+  """The worker exited while running a call, which may have taken effect."""
+
+
+def routing_key(update):
+  if update.effective_chat:
+    return update.effective_chat.id
+  if update.effective_user:
+    return update.effective_user.id
+  return update.update_id
+
+
+class ShardedDispatcher:
+  """Fans updates out to worker processes, one bounded queue per worker.
+
+  Every update for a chat goes to the same worker, and each worker handles
+  its queue in order, so per-user ordering is kept. A full queue blocks (or
+  times out) the producer, and a supervisor thread restarts dead workers.
+
+  Workers run `worker(shard, inbox, outbox, *worker_args)` in a spawned
+  process. `outbox` is the sending end of a pipe: for each call() the worker
+  sends (call_id, "started", None) before running it and
+  (call_id, "done", error) afterwards.
+  """
+
+  def __init__(self, num_workers, worker, worker_args=(), queue_size=100):
+    self._ctx = multiprocessing.get_context("spawn")
+    self._worker = worker
+    self._worker_args = worker_args
+    self._queue_size = queue_size
+    self._queues = [None] * num_workers
+    self._procs = [None] * num_workers
+    self._pending = {}  # call id -> (inbox it was queued on, Future)
+    self._started = set()  # ids of pending calls a worker has begun
+    self._dead_inboxes = weakref.WeakSet()
+    self._pending_lock = threading.Lock()
+    self._call_ids = itertools.count()
+    self._ring = HashRing(range(num_workers))
+    self._stopping = threading.Event()
+
+  def start(self, check_interval=1.0):
+    for shard in range(len(self._procs)):
+      self._spawn(shard)
+    threading.Thread(
+        target=self._supervise,
+        args=(check_interval,),
+        name="shard-supervisor",
+        daemon=True,
+    ).start()
+
+  def _spawn(self, shard):
+    # A worker killed while blocked in get() never releases the queue's read
+    # lock, so every (re)started worker gets a fresh queue. Items still in
+    # the old queue are lost.
+    inbox = self._ctx.Queue(maxsize=self._queue_size)
+    # A pipe rather than a queue: send() has written the message by the time
+    # it returns, so a "started" report cannot be lost with the worker.
+    results, outbox = self._ctx.Pipe(duplex=False)
+    proc = self._ctx.Process(
+        target=self._worker,
+        args=(shard, inbox, outbox, *self._worker_args),
+        name=f"bot-worker-{shard}",
+        daemon=True,
+    )
+    proc.start()
+    # Only the worker holds the sending end now, so its exit ends the pipe.
+    outbox.close()
+    self._queues[shard] = inbox
+    self._procs[shard] = proc
+    threading.Thread(
+        target=self._collect,
+        args=(shard, inbox, results),
+        name=f"shard-results-{shard}",
+        daemon=True,
+    ).start()
+
+  def _collect(self, shard, inbox, results):
+    # Runs until the worker exits and every report it sent has been read.
+    with results:
+      while True:
+        try:
+          if not results.poll(1):
+            if self._stopping.is_set():
+              return
+            continue
+          call_id, status, error = results.recv()
+        except (EOFError, OSError):
+          break
+        if status == "started":
+          with self._pending_lock:
+            if call_id in self._pending:
+              self._started.add(call_id)
+          continue
+        with self._pending_lock:
+          self._started.discard(call_id)
+          _, future = self._pending.pop(call_id, (None, None))
+        if future is not None:
+          self._resolve(future, error)
+    self._fail_pending(inbox, shard)
+
+  @staticmethod
+  def _resolve(future, error):
+    try:
+      if error is None:
+        future.set_result(None)
+      else:
+        future.set_exception(error)
+    except concurrent.futures.InvalidStateError:
+      pass  # cancelled by the caller
+
+  def _fail_pending(self, inbox, shard):
+    # Calls still queued never ran and are safe to retry; one the worker had
+    # started may have taken effect.
+    with self._pending_lock:
+      self._dead_inboxes.add(inbox)
+      lost = [cid for cid, (q, _) in self._pending.items() if q is inbox]
+      failed = []
+      for cid in lost:
+        _, future = self._pending.pop(cid)
+        if cid in self._started:
+          self._started.discard(cid)
+          error = CallInterrupted(f"Worker {shard} exited during the call")
+        else:
+          error = WorkerLost(f"Worker {shard} exited before the call started")
+        failed.append((future, error))
+    for future, error in failed:
+      self._resolve(future, error)
+
+  def _supervise(self, check_interval):
+    while not self._stopping.wait(check_interval):
+      for shard, proc in enumerate(self._procs):
+        if not proc.is_alive():
+          try:
+            lost = self._queues[shard].qsize()
+          except NotImplementedError:  # macOS
+            lost = "unknown"
+          logger.warning(
+              "Worker %s exited with code %s, restarting; %s queued items lost",
+              shard,
+              proc.exitcode,
+              lost,
+          )
+          self._spawn(shard)
+
+  def _put(self, key, item, timeout):
+    shard = self._ring.node_for(key)
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while True:
+      # Wait in short steps so a queue swapped in by a restart is picked up.
+      wait = 1.0
+      if deadline is not None:
+        wait = max(min(wait, deadline - time.monotonic()), 0)
+      inbox = self._queues[shard]
+      try:
+        inbox.put(item, timeout=wait)
+        return inbox
+      except queue.Full:
+        if deadline is not None and time.monotonic() >= deadline:
+          raise
+
+  def dispatch(self, update, timeout=None):
+    """Queue an update for its shard. Raises queue.Full on timeout."""
+    self._put(routing_key(update), ("update", update.to_dict()), timeout)
+
+  def call(self, key, func, *args, timeout=None):
+    """Run `await func(application, *args)` on the worker owning `key`.
+
+    Returns a concurrent.futures.Future that resolves once the worker has
+    run the call, with the exception it raised, with WorkerLost if the
+    worker died before starting it, or with CallInterrupted if it died while
+    running it. Raises queue.Full if the call cannot be queued.
+    """
+    call_id = next(self._call_ids)
+    future = concurrent.futures.Future()
+    with self._pending_lock:
+      self._pending[call_id] = (None, future)
+    try:
+      inbox = self._put(key, ("call", (call_id, func, args)), timeout)
+    except queue.Full:
+      with self._pending_lock:
+        self._pending.pop(call_id, None)
+      raise
+
+    with self._pending_lock:
+      if call_id in self._pending:
+        if inbox in self._dead_inboxes:
+          # The worker exited while we were queueing on its inbox.
+          del self._pending[call_id]
+          future.set_exception(WorkerLost("Worker restarted"))
+        else:
+          self._pending[call_id] = (inbox, future)
+    return future
+
+  def stop(self):
+    self._stopping.set()
+    for q in self._queues:
+      q.put(None)
+    for proc in self._procs:
+      proc.join(timeout=10)
+
+
+def run_worker(shard, inbox, outbox, token, build_application):
+  logger.info("Bot worker %s started", shard)
+  asyncio.run(_process_updates(token, inbox, outbox, build_application))
+
+
+def _picklable(exc):
+  try:
+    pickle.dumps(exc)
+  except Exception:
+    return RuntimeError(repr(exc))
+  return exc
+
+
+async def _process_updates(token, inbox, outbox, build_application):
+  application = build_application(token)
+  async with application:
+    if application.post_init:
+      await application.post_init(application)
+    await application.start()
+
+    while True:
+      item = await asyncio.to_thread(inbox.get)
+      if item is None:
+        break
+
+      kind, payload = item
+      if kind == "update":
+        await application.process_update(
+            Update.de_json(payload, application.bot)
+        )
+      else:
+        call_id, func, args = payload
+        outbox.send((call_id, "started", None))
+        error = None
+        try:
+          await func(application, *args)
+        except Exception as exc:
+          logger.exception("Worker call %s failed", func.__name__)
+          error = _picklable(exc)
+        outbox.send((call_id, "done", error))
+
+    await application.stop()
+
+
+async def poll_updates(token, dispatcher, poll_timeout=30):
+  """Long-poll getUpdates and hand every update to `dispatcher`."""
+  async with Bot(token) as bot:
+    await bot.delete_webhook(drop_pending_updates=True)
+    offset = None
+    while True:
+      try:
+        updates = await bot.get_updates(
+            offset=offset,
+            timeout=poll_timeout,
+            allowed_updates=Update.ALL_TYPES,
+        )
+      except TelegramError as exc:
+        logger.warning("getUpdates failed: %s", exc)
+        await asyncio.sleep(1)
+        continue
+
+      for update in updates:
+        try:
+          dispatcher.dispatch(update, timeout=0)
+        except queue.Full:
+          # Backpressure: stop fetching until the shard has room.
+          await asyncio.to_thread(dispatcher.dispatch, update)
+        offset = update.update_id + 1
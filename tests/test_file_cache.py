@@ -0,0 +1,105 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+from types import SimpleNamespace
+
+from file_cache import FileIdCache
+
+
+class FakeBot:
+
+  def __init__(self, bot_id=1):
+    self.id = bot_id
+    self.sent = []
+
+  async def send_document(self, chat_id, document, **kwargs):
+    uploaded = not isinstance(document, str)
+    self.sent.append("upload" if uploaded else document)
+    file_id = f"id-{len(self.sent)}" if uploaded else document
+    return SimpleNamespace(document=SimpleNamespace(file_id=file_id))
+
+
+def test_send_document_uploads_once_and_reuploads_changed_files(tmp_path):
+  pdf = tmp_path / "sample.pdf"
+  pdf.write_bytes(b"%PDF-1 first")
+  cache = FileIdCache(str(tmp_path / "cache.json"))
+  bot = FakeBot()
+
+  async def send():
+    await cache.send_document(bot, 100, str(pdf))
+
+  asyncio.run(send())
+  asyncio.run(send())
+  pdf.write_bytes(b"%PDF-1 second version")
+  asyncio.run(send())
+
+  assert bot.sent == ["upload", "id-1", "upload"]
+  reloaded = FileIdCache(str(tmp_path / "cache.json"))
+  assert list(reloaded._entries["1"].values()) == [
+      {"file_id": "id-3", "path": str(pdf)}
+  ]
+
+
+def test_processes_sharing_a_file_do_not_overwrite_each_other(tmp_path):
+  path = str(tmp_path / "cache.json")
+  first, second = FileIdCache(path), FileIdCache(path)
+
+  first.set(1, "aaa", "a.pdf", "id-a")
+  first._save()
+  second.set(1, "bbb", "b.pdf", "id-b")
+  second._save()
+  second.discard(1, "aaa")
+  first.set(2, "aaa", "a.pdf", "id-a2")
+  second._save()
+  first._save()
+
+  assert FileIdCache(path)._entries == {
+      "1": {"bbb": {"file_id": "id-b", "path": "b.pdf"}},
+      "2": {"aaa": {"file_id": "id-a2", "path": "a.pdf"}},
+  }
+
+
+def test_concurrent_saves_from_threads(tmp_path):
+  cache = FileIdCache(str(tmp_path / "cache.json"))
+  errors = []
+
+  def save_many(n):
+    for i in range(100):
+      cache.set(1, f"{n}-{i}", f"{n}-{i}.pdf", "id")
+      try:
+        cache._save()
+      except Exception as exc:
+        errors.append(exc)
+
+  threads = [threading.Thread(target=save_many, args=(n,)) for n in range(4)]
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join()
+
+  assert errors == []
+  assert len(FileIdCache(cache.path)._entries["1"]) == 400
+  assert sorted(os.listdir(tmp_path)) == ["cache.json", "cache.json.lock"]
+
+
+def save_from_process(path, n):
+  cache = FileIdCache(path)
+  for i in range(50):
+    cache.set(1, f"{n}-{i}", f"{n}-{i}.pdf", "id")
+    cache._save()
+
+
+def test_concurrent_saves_from_processes(tmp_path):
+  path = str(tmp_path / "cache.json")
+  ctx = multiprocessing.get_context("spawn")
+  procs = [
+      ctx.Process(target=save_from_process, args=(path, n)) for n in range(4)
+  ]
+  for proc in procs:
+    proc.start()
+  for proc in procs:
+    proc.join(timeout=60)
+    assert proc.exitcode == 0
+
+  assert len(FileIdCache(path)._entries["1"]) == 200
@@ -0,0 +1,90 @@
+import logging
+import queue
+import time
+
+from logs import (
+    DroppingQueueHandler,
+    RateLimitFilter,
+    _ReportingListener,
+    parse_sample_rates,
+)
+
+
+def make_record(name="httpx", level=logging.INFO, msg="request", args=None):
+  return logging.makeLogRecord(
+      {"name": name, "levelno": level, "msg": msg, "args": args}
+  )
+
+
+class ListHandler(logging.Handler):
+
+  def __init__(self):
+    super().__init__()
+    self.records = []
+
+  def emit(self, record):
+    self.records.append(record)
+
+
+def test_rate_limit_filter_samples_and_counts_suppressed_records():
+  sampler = RateLimitFilter({"httpx": 10, "httpx.pool": 1})
+
+  passed = [sampler.filter(make_record()) for _ in range(15)]
+  assert passed.count(True) == 10
+  # The longest matching prefix has its own bucket.
+  assert sampler.filter(make_record("httpx.pool"))
+  assert not sampler.filter(make_record("httpx.pool"))
+  # Warnings and unrelated loggers are never sampled out.
+  assert sampler.filter(make_record(level=logging.WARNING))
+  assert sampler.filter(make_record("httpxyz"))
+
+  time.sleep(0.15)
+  record = make_record()
+  assert sampler.filter(record)
+  assert record.sampled_out == 5
+
+
+def test_slow_rate_lets_the_first_record_through():
+  sampler = RateLimitFilter({"httpx": 0.5})
+
+  assert sampler.filter(make_record())
+  assert not sampler.filter(make_record())
+
+
+def test_queue_handler_counts_drops_and_leaves_the_record_alone():
+  handler = DroppingQueueHandler(queue.Queue(maxsize=1))
+  args = ["first"]
+  record = make_record(msg="value: %s", args=(args,))
+
+  handler.handle(record)
+  handler.handle(make_record())
+  assert handler.dropped == 1
+
+  queued = handler.queue.get_nowait()
+  args[0] = "changed"
+  assert queued.getMessage() == "value: ['first']"
+  assert record.msg == "value: %s"
+  assert record.args == (args,)
+
+
+def test_listener_reports_dropped_records():
+  handler = DroppingQueueHandler(queue.Queue(maxsize=1))
+  output = ListHandler()
+  listener = _ReportingListener(handler.queue, handler, output)
+
+  handler.handle(make_record(msg="kept"))
+  handler.handle(make_record(msg="lost"))
+  handler.handle(make_record(msg="lost"))
+  listener.start()
+  listener.stop()
+
+  messages = [record.getMessage() for record in output.records]
+  assert messages == ["Dropped 2 log records (queue full)", "kept"]
+  assert output.records[0].levelno == logging.WARNING
+
+
+def test_parse_sample_rates_skips_invalid_entries(caplog):
+  rates = parse_sample_rates(" httpx=1, telegram.ext=2.5 ,,bad,=3,x=0,y=abc")
+
+  assert rates == {"httpx": 1.0, "telegram.ext": 2.5}
+  assert caplog.text.count("Ignoring invalid log sample rate") == 4
@@ -0,0 +1,122 @@
+import asyncio
+import json
+
+import pytest
+from telegram.error import NetworkError
+from telegram.ext import Application
+from telegram.request import BaseRequest
+
+import multibot
+
+
+class FailingRequest(BaseRequest):
+  """Request that opens and closes like HTTPXRequest but never connects."""
+
+  instances = []
+
+  def __init__(self, *args, **kwargs):
+    self.open = False
+    FailingRequest.instances.append(self)
+
+  @property
+  def read_timeout(self):
+    return None
+
+  async def initialize(self):
+    self.open = True
+
+  async def shutdown(self):
+    self.open = False
+
+  async def do_request(self, *args, **kwargs):
+    raise NetworkError("no network in tests")
+
+
+def build_application(token, **builder_options):
+  builder = Application.builder().token(token)
+  for option, value in builder_options.items():
+    builder = getattr(builder, option)(value)
+  return builder.build()
+
+
+def write_config(tmp_path, configs):
+  path = tmp_path / "bots.json"
+  path.write_text(json.dumps(configs))
+  return str(path)
+
+
+def test_load_bot_configs_resolves_tokens(tmp_path, monkeypatch):
+  monkeypatch.setenv("AME_BOT_TOKEN", "123:ame")
+  path = write_config(tmp_path, [
+      {"name": "ame", "token_env": "AME_BOT_TOKEN", "stream": "ame"},
+      {"name": "pilot", "token": "456:pilot"},
+      {"name": "missing", "token_env": "UNSET_BOT_TOKEN"},
+  ])
+
+  bots = multibot.load_bot_configs(path)
+
+  assert [(bot["name"], bot["token"], bot.get("stream")) for bot in bots] == [
+      ("ame", "123:ame", "AME"),
+      ("pilot", "456:pilot", None),
+  ]
+
+
+def test_load_bot_configs_rejects_duplicate_names(tmp_path):
+  path = write_config(tmp_path, [
+      {"name": "ame", "token": "1:a"},
+      {"name": "ame", "token": "2:b"},
+  ])
+
+  with pytest.raises(ValueError, match="ame"):
+    multibot.load_bot_configs(path)
+
+
+@pytest.mark.parametrize("configs", [
+    {"name": "ame", "token": "1:a"},
+    [{"token": "1:a"}],
+    ["ame"],
+    [{"name": "ame", "token": "1:a", "stream": "CPL"}],
+    [{"name": "ame", "token": "1:a", "stream": 1}],
+])
+def test_load_bot_configs_rejects_malformed_entries(tmp_path, configs):
+  path = write_config(tmp_path, configs)
+
+  with pytest.raises(ValueError):
+    multibot.load_bot_configs(path)
+
+
+def test_bots_that_fail_to_start_release_the_shared_pool(monkeypatch):
+  FailingRequest.instances.clear()
+  monkeypatch.setattr(multibot, "HTTPXRequest", FailingRequest)
+  started = []
+
+  async def on_started(applications):
+    started.append(applications)
+    raise asyncio.CancelledError
+
+  bots = [{"name": "one", "token": "1:a"}, {"name": "two", "token": "2:b"}]
+  with pytest.raises(asyncio.CancelledError):
+    asyncio.run(multibot.run_bots(bots, build_application, on_started))
+
+  assert started == [{}]
+  assert FailingRequest.instances
+  assert not any(request.open for request in FailingRequest.instances)
+
+
+def test_rate_limiter_throttles_after_burst():
+  metrics = multibot.BotMetrics()
+  limiter = multibot.BotRateLimiter(metrics, rate=100, burst=2)
+
+  async def call():
+    return "ok"
+
+  async def send_many():
+    for _ in range(5):
+      await limiter.process_request(call, (), {}, "sendMessage", {}, None)
+    for _ in range(3):
+      await limiter.process_request(call, (), {}, "getUpdates", {}, None)
+
+  asyncio.run(send_many())
+
+  assert metrics.api_calls == 8
+  assert metrics.throttled == 3
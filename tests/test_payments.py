@@ -0,0 +1,153 @@
+import asyncio
+import json
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import razorpay
+
+from payments import RazorpayGateway
+
+
+class StubRazorpay(ThreadingHTTPServer):
+  """Local stand-in for the Razorpay orders API."""
+
+  daemon_threads = True
+
+  def __init__(self):
+    super().__init__(("127.0.0.1", 0), _StubHandler)
+    self.orders = {}
+    self.hits = Counter()
+    self.delay = 0.0
+    self.in_flight = 0
+    self.max_in_flight = 0
+    self._lock = threading.Lock()
+
+  @property
+  def base_url(self):
+    return f"http://127.0.0.1:{self.server_address[1]}"
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+
+  def do_GET(self):
+    server = self.server
+    order_id = self.path.split("?")[0].rsplit("/", 1)[-1]
+    with server._lock:
+      server.hits[order_id] += 1
+      server.in_flight += 1
+      server.max_in_flight = max(server.max_in_flight, server.in_flight)
+    time.sleep(server.delay)
+    with server._lock:
+      server.in_flight -= 1
+
+    if order_id in server.orders:
+      status, body = 200, server.orders[order_id]
+    else:
+      status, body = 400, {
+          "error": {
+              "code": "BAD_REQUEST_ERROR",
+              "description": "The id provided does not exist",
+          }
+      }
+    payload = json.dumps(body).encode()
+    self.send_response(status)
+    self.send_header("Content-Type", "application/json")
+    self.send_header("Content-Length", str(len(payload)))
+    self.end_headers()
+    self.wfile.write(payload)
+
+  def log_message(self, *args):
+    pass
+
+
+@pytest.fixture
+def stub():
+  server = StubRazorpay()
+  thread = threading.Thread(target=server.serve_forever, daemon=True)
+  thread.start()
+  yield server
+  server.shutdown()
+  server.server_close()
+
+
+@pytest.fixture
+def gateway(stub):
+  gateway = RazorpayGateway(
+      "rzp_test_key", "secret", base_url=stub.base_url, max_workers=8
+  )
+  yield gateway
+  gateway.close()
+
+
+def order(order_id, status):
+  return {"id": order_id, "status": status, "amount": 49900, "notes": {}}
+
+
+def test_concurrent_lookups_share_one_request(stub, gateway):
+  stub.orders["order_A"] = order("order_A", "created")
+  stub.delay = 0.2
+
+  async def lookup():
+    return await asyncio.gather(
+        *(gateway.fetch_order("order_A") for _ in range(10))
+    )
+
+  results = asyncio.run(lookup())
+
+  assert stub.hits["order_A"] == 1
+  assert all(result["id"] == "order_A" for result in results)
+
+
+def test_only_settled_states_are_cached(stub, gateway):
+  stub.orders["order_paid"] = order("order_paid", "paid")
+  stub.orders["order_open"] = order("order_open", "created")
+
+  async def lookup_twice():
+    for _ in range(2):
+      await gateway.fetch_order("order_paid")
+      await gateway.fetch_order("order_open")
+
+  asyncio.run(lookup_twice())
+
+  assert stub.hits["order_paid"] == 1
+  assert stub.hits["order_open"] == 2
+
+
+def test_cached_state_expires_after_ttl(stub, gateway):
+  stub.orders["order_paid"] = order("order_paid", "paid")
+  gateway.cache_ttl = 0.05
+
+  async def lookup_after_expiry():
+    await gateway.fetch_order("order_paid")
+    await asyncio.sleep(0.1)
+    await gateway.fetch_order("order_paid")
+
+  asyncio.run(lookup_after_expiry())
+
+  assert stub.hits["order_paid"] == 2
+
+
+def test_fetch_orders_is_batched(stub, gateway):
+  ids = [f"order_{i}" for i in range(7)]
+  for order_id in ids:
+    stub.orders[order_id] = order(order_id, "created")
+  stub.delay = 0.05
+  gateway.batch_size = 3
+
+  results = asyncio.run(gateway.fetch_orders(ids + ids[:2]))
+
+  assert list(results) == ids
+  assert sum(stub.hits.values()) == len(ids)
+  assert stub.max_in_flight <= 3
+
+
+def test_fetch_orders_returns_errors_per_id(stub, gateway):
+  stub.orders["order_ok"] = order("order_ok", "paid")
+
+  results = asyncio.run(gateway.fetch_orders(["order_ok", "order_missing"]))
+
+  assert results["order_ok"]["status"] == "paid"
+  assert isinstance(results["order_missing"], razorpay.errors.BadRequestError)
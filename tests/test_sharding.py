@@ -0,0 +1,89 @@
+import multiprocessing
+import os
+import signal
+import time
+from collections import Counter
+
+import pytest
+
+from sharding import CallInterrupted, HashRing, ShardedDispatcher, WorkerLost
+
+
+def echo_worker(shard, inbox, outbox, results):
+  while True:
+    item = inbox.get()
+    if item is None:
+      return
+    _, (call_id, func, args) = item
+    outbox.send((call_id, "started", None))
+    results.put((shard, os.getpid(), func))
+    if func == "fail":
+      outbox.send((call_id, "done", ValueError("boom")))
+    elif func != "hang":
+      outbox.send((call_id, "done", None))
+
+
+def test_hash_ring_spreads_keys_and_moves_few_on_resize():
+  ring = HashRing(range(4))
+  counts = Counter(ring.node_for(key) for key in range(20000))
+  assert set(counts) == {0, 1, 2, 3}
+  assert min(counts.values()) > 20000 / 4 * 0.8
+
+  grown = HashRing(range(5))
+  moved = sum(ring.node_for(key) != grown.node_for(key) for key in range(20000))
+  assert moved < 20000 * 0.3
+
+
+@pytest.fixture
+def dispatcher():
+  results = multiprocessing.get_context("spawn").Queue()
+  dispatcher = ShardedDispatcher(2, echo_worker, worker_args=(results,))
+  dispatcher.start(check_interval=0.1)
+  yield dispatcher, results
+  dispatcher.stop()
+
+
+def test_killed_worker_is_replaced_and_keeps_its_shard(dispatcher, caplog):
+  dispatcher, results = dispatcher
+
+  dispatcher.call(42, "first")
+  shard, pid, func = results.get(timeout=30)
+  assert func == "first"
+
+  # The worker is now blocked in inbox.get(), holding the queue's read lock.
+  time.sleep(0.2)
+  os.kill(pid, signal.SIGKILL)
+
+  deadline = time.monotonic() + 30
+  while dispatcher._procs[shard].pid == pid:
+    assert time.monotonic() < deadline, "worker was not restarted"
+    time.sleep(0.05)
+
+  dispatcher.call(42, "second")
+  new_shard, new_pid, func = results.get(timeout=30)
+  assert (new_shard, func) == (shard, "second")
+  assert new_pid != pid
+  assert "0 queued items lost" in caplog.text
+
+
+def test_call_reports_the_worker_outcome(dispatcher):
+  dispatcher, _ = dispatcher
+
+  assert dispatcher.call(7, "ok").result(timeout=30) is None
+  with pytest.raises(ValueError, match="boom"):
+    dispatcher.call(7, "fail").result(timeout=30)
+
+
+def test_calls_pending_on_a_dead_worker_fail(dispatcher):
+  dispatcher, results = dispatcher
+
+  running = dispatcher.call(42, "hang")
+  _, pid, _ = results.get(timeout=30)
+  queued = dispatcher.call(42, "never")
+  os.kill(pid, signal.SIGKILL)
+
+  # Only the call that never started is safe to retry.
+  with pytest.raises(CallInterrupted):
+    running.result(timeout=30)
+  with pytest.raises(WorkerLost):
+    queued.result(timeout=30)
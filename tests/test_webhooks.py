@@ -0,0 +1,85 @@
+import hashlib
+import hmac
+import threading
+import time
+
+from webhooks import ACCEPTED, BUSY, DUPLICATE, DeliveryUncertain, WebhookInbox
+
+
+def wait_for(condition, timeout=2.0):
+  deadline = time.monotonic() + timeout
+  while not condition():
+    assert time.monotonic() < deadline, "timed out"
+    time.sleep(0.01)
+
+
+def test_verify_checks_hmac_signature():
+  inbox = WebhookInbox("secret", lambda event: None)
+  body = b'{"event": "payment.captured"}'
+  signature = hmac.new(b"secret", body, hashlib.sha256).hexdigest()
+
+  assert inbox.verify(body, signature)
+  assert not inbox.verify(body, "0" * 64)
+  assert not inbox.verify(body, None)
+
+
+def test_duplicates_and_full_queue():
+  inbox = WebhookInbox("secret", lambda event: None, max_queue=1)
+
+  assert inbox.submit("evt_1", {}) == ACCEPTED
+  assert inbox.submit("evt_1", {}) == DUPLICATE
+  assert inbox.submit("evt_2", {}) == BUSY
+  # A rejected event is not remembered, so the sender's retry gets in.
+  inbox.start()
+  wait_for(lambda: inbox.submit("evt_2", {}) == ACCEPTED)
+
+
+def test_failed_events_are_retried_without_blocking_others():
+  calls = []
+
+  def handler(event):
+    calls.append(event)
+    if event == "flaky" and calls.count("flaky") < 3:
+      raise RuntimeError("bot not ready")
+
+  inbox = WebhookInbox("secret", handler, retry_delay=0.05)
+  inbox.start()
+  inbox.submit("evt_flaky", "flaky")
+  inbox.submit("evt_other", "other")
+
+  wait_for(lambda: calls.count("flaky") == 3)
+  assert calls.index("other") < 2
+  assert inbox.submit("evt_flaky", "flaky") == DUPLICATE
+
+
+def test_exhausted_event_can_be_redelivered():
+  attempts = threading.Semaphore(0)
+
+  def handler(event):
+    attempts.release()
+    raise RuntimeError("down")
+
+  inbox = WebhookInbox("secret", handler, max_attempts=2, retry_delay=0.01)
+  inbox.start()
+  inbox.submit("evt_1", {})
+  for _ in range(2):
+    assert attempts.acquire(timeout=2)
+
+  wait_for(lambda: inbox.submit("evt_1", {}) == ACCEPTED)
+
+
+def test_uncertain_delivery_is_not_retried_or_forgotten():
+  calls = []
+
+  def handler(event):
+    calls.append(event)
+    raise DeliveryUncertain("timed out")
+
+  inbox = WebhookInbox("secret", handler, retry_delay=0.01)
+  inbox.start()
+  inbox.submit("evt_1", {})
+  wait_for(lambda: calls)
+  time.sleep(0.1)
+
+  assert len(calls) == 1
+  assert inbox.submit("evt_1", {}) == DUPLICATE
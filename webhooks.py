@@ -0,0 +1,149 @@
+import hashlib
+import heapq
+import hmac
+import itertools
+import logging
+import queue
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+ACCEPTED = "accepted"
+DUPLICATE = "duplicate"
+BUSY = "busy"
+
+
+class DeliveryUncertain(Exception):
+  """The handler may or may not have taken effect, so it must not be retried."""
+
+
+class IdempotencyStore:
+  """Bounded, thread-safe set of recently seen event ids."""
+
+  def __init__(self, max_size=10000):
+    self.max_size = max_size
+    self._seen = OrderedDict()
+    self._lock = threading.Lock()
+
+  def add(self, event_id):
+    """Record `event_id`, returning False if it was already present."""
+    with self._lock:
+      if event_id in self._seen:
+        self._seen.move_to_end(event_id)
+        return False
+      self._seen[event_id] = None
+      while len(self._seen) > self.max_size:
+        self._seen.popitem(last=False)
+      return True
+
+  def discard(self, event_id):
+    with self._lock:
+      self._seen.pop(event_id, None)
+
+
+class WebhookInbox:
+  """Verifies, deduplicates and queues webhook events for a worker thread.
+
+  The HTTP handler only does signature checking and an in-memory enqueue, so
+  it answers immediately; `handler(event)` runs later on the worker thread.
+  The sender will not retry an acknowledged event, so failed handler calls
+  are retried here with exponential backoff, without holding up other events.
+  """
+
+  def __init__(
+      self,
+      secret,
+      handler,
+      max_queue=1000,
+      max_seen=10000,
+      max_attempts=6,
+      retry_delay=1.0,
+      describe=repr,
+  ):
+    self._secret = secret.encode()
+    self._handler = handler
+    self._describe = describe
+    self._queue = queue.Queue(maxsize=max_queue)
+    self._seen = IdempotencyStore(max_seen)
+    self._retries = []  # heap of (due, seq, event_id, event, attempt)
+    self._seq = itertools.count()
+    self._thread = None
+    self.max_attempts = max_attempts
+    self.retry_delay = retry_delay
+
+  def verify(self, body, signature):
+    expected = hmac.new(self._secret, body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature or "")
+
+  def submit(self, event_id, event):
+    if not self._seen.add(event_id):
+      return DUPLICATE
+    try:
+      self._queue.put_nowait((event_id, event, 1))
+    except queue.Full:
+      # Not accepted, so let the sender's retry through.
+      self._seen.discard(event_id)
+      return BUSY
+    return ACCEPTED
+
+  def start(self):
+    if self._thread is None:
+      self._thread = threading.Thread(
+          target=self._run, name="webhook-worker", daemon=True
+      )
+      self._thread.start()
+
+  def _next_item(self):
+    if self._retries and self._retries[0][0] <= time.monotonic():
+      _, _, event_id, event, attempt = heapq.heappop(self._retries)
+      return event_id, event, attempt
+    timeout = None
+    if self._retries:
+      timeout = self._retries[0][0] - time.monotonic()
+    try:
+      return self._queue.get(timeout=timeout)
+    except queue.Empty:
+      return None
+
+  def _run(self):
+    while True:
+      item = self._next_item()
+      if item is not None:
+        self._process(*item)
+
+  def _process(self, event_id, event, attempt):
+    try:
+      self._handler(event)
+    except DeliveryUncertain:
+      # Keep the id marked as seen: a redelivery could act twice.
+      logger.error(
+          "Webhook event %s (%s) may not have been processed; not retrying",
+          event_id,
+          self._describe(event),
+          exc_info=True,
+      )
+    except Exception:
+      if attempt < self.max_attempts:
+        delay = self.retry_delay * 2 ** (attempt - 1)
+        logger.warning(
+            "Webhook event %s failed (attempt %s), retrying in %.0fs",
+            event_id,
+            attempt,
+            delay,
+            exc_info=True,
+        )
+        due = time.monotonic() + delay
+        entry = (due, next(self._seq), event_id, event, attempt + 1)
+        heapq.heappush(self._retries, entry)
+        return
+      logger.error(
+          "Dropping webhook event %s (%s) after %s attempts",
+          event_id,
+          self._describe(event),
+          attempt,
+          exc_info=True,
+      )
+      # Allow a manual redelivery of this event to be processed again.
+      self._seen.discard(event_id)